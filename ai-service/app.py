@@ -2,33 +2,54 @@
 AI Service for Face Recognition
 Handles face detection, embedding extraction, and similarity matching
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, ValidationError
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import numpy as np
-from deepface import DeepFace
-from ultralytics import YOLO
-from insightface.app import FaceAnalysis
 import cv2
 from PIL import Image
 import io
+import json
+import multiprocessing
 import os
+import time
+
+from model_host import REPLY_TIMEOUT_SECONDS, ModelHostClient, load_models, yolo_boxes
 
 app = FastAPI(title="AI Attendance Service", version="1.0.0")
 
-# ---------------- YOLOv8 Face Detector ----------------
-yolo_face = YOLO(
-    os.path.join(os.path.dirname(__file__), "yolov9t-face-lindevs.pt")
-)  # lightweight & fast
+# ---------------- Face Models ----------------
+# With MODEL_HOST_ADDRESS set, models live in a shared model-host process
+# (see model_host.py / serve.py) instead of being loaded in every worker
+MODEL_HOST_ADDRESS = os.environ.get("MODEL_HOST_ADDRESS")
 
-arcface_app = FaceAnalysis(
-    name="buffalo_l",          # stable, bundled model
-    providers=["CPUExecutionProvider"]
-)
-arcface_app.prepare(ctx_id=0, det_size=(640, 640))
+if MODEL_HOST_ADDRESS:
+    model_host = ModelHostClient(
+        MODEL_HOST_ADDRESS,
+        os.environ.get("MODEL_HOST_AUTHKEY", "").encode(),
+        timeout=float(os.environ.get("MODEL_HOST_TIMEOUT") or REPLY_TIMEOUT_SECONDS)
+    )
+    yolo_face, arcface_app = None, None
+else:
+    model_host = None
+    yolo_face, arcface_app = load_models()
+
+
+def run_yolo(image: np.ndarray) -> List[List[int]]:
+    """YOLO face boxes as [x1, y1, x2, y2], from the local model or the model host"""
+    if model_host:
+        return model_host.detect(image)
+    return yolo_boxes(yolo_face, image)
+
+
+def run_insightface(image_bgr: np.ndarray) -> list:
+    """InsightFace faces (with .bbox and .embedding), from the local model or the model host"""
+    if model_host:
+        return model_host.analyze(image_bgr)
+    return arcface_app.get(image_bgr)
 
 
 # CORS middleware to allow frontend and backend to communicate
@@ -62,12 +83,44 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 # Configuration
 SIMILARITY_THRESHOLD = 0.60  # Lowered threshold for better selfie-to-group matching
 MIN_FACE_SIZE = 20  # Minimum face size in pixels to consider
+SESSION_TTL_SECONDS = 12 * 60 * 60  # Attendance sessions idle longer than this are dropped
+DUPLICATE_THRESHOLD = 0.75  # Two enrollments this similar are likely the same person (same 0-1 scale)
+DUPLICATE_TOP_K = 5  # Candidates returned by registration-time duplicate checks
+DUPLICATE_MAX_PAIRS = 10000  # Most similar pairs kept by the duplicate report
+STREAM_CONTEXT_RATIO = 0.5  # Context around each box when streaming embeds faces one at a time
+GALLERY_BLOCK_SIZE = 4096  # Gallery rows per matrix-multiplication block in identity search
+MAX_GALLERY_BLOCK_SIZE = 8192  # Largest block_size a client may ask for (a 256 MB similarity tile)
+MAX_IDENTITY_TOP_K = 100  # Most matches /identity-search returns per query
+# API worker processes: AI_SERVICE_WORKERS is set by serve.py, WEB_CONCURRENCY
+# is how uvicorn and gunicorn take a worker count from the environment
+WORKER_COUNT = int(os.environ.get("AI_SERVICE_WORKERS") or os.environ.get("WEB_CONCURRENCY") or 1)
+
+if WORKER_COUNT == 1 and multiprocessing.parent_process() is not None:
+    # uvicorn --workers N (and --reload) run the app in spawned children without telling it N
+    print("Warning: Running in a child process without AI_SERVICE_WORKERS or WEB_CONCURRENCY set. "
+          "If this is one of several workers, cached galleries and attendance sessions will "
+          "randomly 404; set AI_SERVICE_WORKERS to the worker count to disable them")
+
+
+class IdentityMatch(BaseModel):
+    """Model for an enrolled student similar to a query face"""
+    student_id: str
+    similarity: float
+
+
+class StoredEmbedding(BaseModel):
+    """Model for stored student embedding"""
+    student_id: str
+    embedding: List[float]
 
 
 class FaceRegistrationRequest(BaseModel):
     """Request model for face registration"""
     student_id: str
     images: List[str]  # Base64 encoded images
+    # Check for an existing enrollment in a cached gallery or in inline embeddings
+    gallery_id: Optional[str] = None
+    stored_embeddings: Optional[List[StoredEmbedding]] = None
 
 
 class FaceRegistrationResponse(BaseModel):
@@ -75,6 +128,7 @@ class FaceRegistrationResponse(BaseModel):
     student_id: str
     embedding: List[float]
     message: str
+    possible_duplicates: List[IdentityMatch] = []  # Only filled when gallery_id or stored_embeddings is given
 
 
 class RecognizedFace(BaseModel):
@@ -91,18 +145,366 @@ class RecognitionResponse(BaseModel):
     matched_faces: int
 
 
-class StoredEmbedding(BaseModel):
-    """Model for stored student embedding"""
-    student_id: str
-    embedding: List[float]
-
-
 class MatchFacesRequest(BaseModel):
     """Request model for matching faces with stored embeddings"""
     stored_embeddings: List[StoredEmbedding]
     face_embeddings: List[dict]  # List of {embedding: [...], bbox: [...]}
 
 
+class GalleryRequest(BaseModel):
+    """Request model for caching a class gallery in the service"""
+    stored_embeddings: List[StoredEmbedding]
+
+
+class GalleryResponse(BaseModel):
+    """Response model for a cached gallery"""
+    gallery_id: str
+    students: int
+
+
+class IdentitySearchRequest(BaseModel):
+    """Request model for searching a gallery with one or more face embeddings"""
+    embeddings: List[List[float]]
+    gallery_id: Optional[str] = None
+    stored_embeddings: Optional[List[StoredEmbedding]] = None
+    top_k: int = DUPLICATE_TOP_K
+    threshold: float = DUPLICATE_THRESHOLD
+
+
+class IdentitySearchResult(BaseModel):
+    """Matches for one query embedding, most similar first"""
+    matches: List[IdentityMatch]
+
+
+class IdentitySearchResponse(BaseModel):
+    """Response model for identity search"""
+    results: List[IdentitySearchResult]
+
+
+class DuplicateReportRequest(BaseModel):
+    """Request model for an all-pairs near-duplicate report over a gallery"""
+    gallery_id: Optional[str] = None
+    stored_embeddings: Optional[List[StoredEmbedding]] = None
+    threshold: float = DUPLICATE_THRESHOLD
+    block_size: int = GALLERY_BLOCK_SIZE
+    max_pairs: int = DUPLICATE_MAX_PAIRS
+
+
+class DuplicatePair(BaseModel):
+    """Two enrolled students whose embeddings are near-duplicates"""
+    student_id_a: str
+    student_id_b: str
+    similarity: float
+
+
+class DuplicateReportResponse(BaseModel):
+    """Response model for the near-duplicate report"""
+    students: int
+    pairs: List[DuplicatePair]
+    truncated: bool = False  # More than max_pairs pairs passed the threshold
+    elapsed_seconds: float
+
+
+class Gallery:
+    """
+    Enrolled student embeddings stacked into one matrix for fast matching
+    Rows are L2-normalized so a single matrix product scores a face against every student
+    """
+
+    def __init__(self, stored_embeddings: List[StoredEmbedding]):
+        # Later duplicates overwrite earlier ones, as in the original dict-based matching
+        emb_dict = {}
+        for stored in stored_embeddings:
+            emb_dict[stored.student_id] = stored.embedding
+
+        self.student_ids = list(emb_dict.keys())
+        self.index = {student_id: i for i, student_id in enumerate(self.student_ids)}
+        if emb_dict:
+            self.matrix = normalize_embeddings(np.array(list(emb_dict.values()), dtype=np.float32))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.student_ids)
+
+    def similarities(self, embedding: np.ndarray) -> np.ndarray:
+        """Similarity of one face to every student, on the same 0 to 1 scale as cosine_similarity"""
+        query = normalize_embeddings(np.asarray(embedding, dtype=np.float32))
+        similarity = np.clip(self.matrix @ query, -1.0, 1.0)
+        return (similarity + 1.0) / 2.0
+
+    def best_match(self, embedding: np.ndarray, exclude: set) -> Tuple[Optional[str], float]:
+        """
+        Find the most similar student not in exclude
+
+        Returns:
+            (student_id, similarity), or (None, 0.0) if nobody reaches SIMILARITY_THRESHOLD
+        """
+        if len(self) == 0:
+            return None, 0.0
+
+        similarities = self.similarities(embedding)
+        excluded_rows = [self.index[sid] for sid in exclude if sid in self.index]
+        if excluded_rows:
+            similarities[excluded_rows] = -1.0
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < SIMILARITY_THRESHOLD:
+            return None, 0.0
+        return self.student_ids[best], float(similarities[best])
+
+    def search(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        threshold: float,
+        block_size: int = GALLERY_BLOCK_SIZE
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        Find the top_k most similar students for each query embedding
+        
+        The gallery is scanned in blocks of block_size rows, keeping a running
+        top_k per query, so memory stays at (queries x block_size) similarities.
+        
+        Args:
+            queries: (Q, D) embeddings, or a single (D,) embedding
+            top_k: maximum matches per query
+            threshold: minimum similarity on the 0 to 1 scale
+        
+        Returns:
+            Per query, a list of (student_id, similarity), most similar first
+        """
+        queries = normalize_embeddings(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if len(self) == 0 or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        
+        top_similarities = np.empty((len(queries), 0), dtype=np.float32)
+        top_rows = np.empty((len(queries), 0), dtype=np.int64)
+        
+        for start in range(0, len(self), block_size):
+            block = self.matrix[start:start + block_size]
+            similarities = np.concatenate([top_similarities, queries @ block.T], axis=1)
+            rows = np.concatenate([
+                top_rows,
+                np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))
+            ], axis=1)
+            
+            if similarities.shape[1] > top_k:
+                keep = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+                similarities = np.take_along_axis(similarities, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            top_similarities, top_rows = similarities, rows
+        
+        results = []
+        for similarities, rows in zip(top_similarities, top_rows):
+            order = np.argsort(-similarities)
+            matches = []
+            for i in order:
+                similarity = float((np.clip(similarities[i], -1.0, 1.0) + 1.0) / 2.0)
+                if similarity < threshold:
+                    break
+                matches.append((self.student_ids[rows[i]], similarity))
+            results.append(matches)
+        return results
+
+    def duplicate_pairs(
+        self,
+        threshold: float,
+        block_size: int = GALLERY_BLOCK_SIZE,
+        max_pairs: Optional[int] = None
+    ) -> Tuple[List[Tuple[str, str, float]], bool]:
+        """
+        All pairs of students at or above threshold similarity
+        
+        Computes the upper triangle of the gallery's similarity matrix one
+        (block_size x block_size) tile at a time, so memory stays bounded
+        no matter how many students are enrolled. With max_pairs, only the
+        most similar pairs are kept, and once that many have been found the
+        threshold rises to the weakest kept pair for the remaining tiles.
+        
+        Returns:
+            ((student_id_a, student_id_b, similarity) tuples, most similar first,
+             and whether pairs were dropped because of max_pairs)
+        """
+        # Compare raw cosines so tiles never need rescaling to the 0-1 range
+        cos_threshold = 2.0 * threshold - 1.0
+        found_rows, found_cols, found_cosines = [], [], []
+        found = 0
+        truncated = False
+        
+        for row_start in range(0, len(self), block_size):
+            rows = self.matrix[row_start:row_start + block_size]
+            for col_start in range(row_start, len(self), block_size):
+                tile = rows @ self.matrix[col_start:col_start + block_size].T
+                close = tile >= cos_threshold
+                if col_start == row_start:
+                    # Keep each pair once and drop self-similarity on the diagonal
+                    close = np.triu(close, k=1)
+                
+                i, j = np.nonzero(close)
+                if len(i) == 0:
+                    continue
+                found_rows.append(i + row_start)
+                found_cols.append(j + col_start)
+                found_cosines.append(tile[i, j])
+                found += len(i)
+                
+                if max_pairs is not None and found > max_pairs:
+                    # Keep the max_pairs most similar so far and raise the bar to match
+                    pair_rows, pair_cols, cosines = (
+                        np.concatenate(parts) for parts in (found_rows, found_cols, found_cosines)
+                    )
+                    keep = np.argpartition(-cosines, max_pairs - 1)[:max_pairs]
+                    found_rows, found_cols, found_cosines = [pair_rows[keep]], [pair_cols[keep]], [cosines[keep]]
+                    found = max_pairs
+                    cos_threshold = max(cos_threshold, float(cosines[keep].min()))
+                    truncated = True
+        
+        if found == 0:
+            return [], truncated
+        
+        pair_rows, pair_cols, cosines = (
+            np.concatenate(parts) for parts in (found_rows, found_cols, found_cosines)
+        )
+        pairs = [
+            (
+                self.student_ids[pair_rows[k]],
+                self.student_ids[pair_cols[k]],
+                float((min(cosines[k], 1.0) + 1.0) / 2.0)
+            )
+            for k in np.argsort(-cosines, kind="stable")
+        ]
+        return pairs, truncated
+
+
+# Galleries cached by /galleries, keyed by gallery_id (e.g. a class id)
+galleries: Dict[str, Gallery] = {}
+
+
+def require_single_worker(feature: str):
+    """
+    Refuse features backed by in-process state when several workers serve the API
+    Each worker has its own galleries and sessions, so follow-up requests
+    routed to another worker would not find them
+    """
+    if WORKER_COUNT > 1:
+        raise HTTPException(
+            status_code=503,
+            detail=f"{feature} are unavailable with {WORKER_COUNT} workers; "
+                   "run a single worker or pass stored_embeddings inline"
+        )
+
+
+class AttendanceSessionRequest(BaseModel):
+    """Request model for starting an attendance session"""
+    class_id: str
+    date: str
+    gallery_id: Optional[str] = None
+    stored_embeddings: Optional[List[StoredEmbedding]] = None
+
+
+class AttendanceSessionResponse(BaseModel):
+    """Response model for attendance session state"""
+    session_id: str
+    class_id: str
+    date: str
+    students: int
+    present_student_ids: List[str]
+    photos_processed: int
+
+
+class SessionPhotoResponse(BaseModel):
+    """Response model for a photo added to an attendance session"""
+    recognized_faces: List[RecognizedFace]  # Newly matched faces only
+    total_faces_detected: int
+    matched_faces: int
+    duplicate_faces: int  # Faces already matched in an earlier photo of the session
+    present_student_ids: List[str]
+
+
+class AttendanceSession:
+    """
+    Attendance state for one class on one date, kept across photos
+    
+    Remembers which students are present. Each face in a later photo is
+    scored against the whole gallery: if its best match is a student already
+    present it is counted as a duplicate, and only faces whose best match is
+    still absent mark a new student present.
+    """
+
+    def __init__(self, session_id: str, class_id: str, date: str, gallery: Gallery):
+        self.session_id = session_id
+        self.class_id = class_id
+        self.date = date
+        self.gallery = gallery
+        self.matched_student_ids = set()
+        self.present_student_ids: List[str] = []  # In match order
+        self.photos_processed = 0
+        self.updated_at = time.time()
+
+    def add_photo(self, face_embeddings: Iterable[dict]) -> Tuple[List[RecognizedFace], int]:
+        """
+        Match the faces of a new photo, counting faces of present students as duplicates
+        
+        Returns:
+            (newly recognized faces, number of faces of students already present)
+        """
+        recognized_faces = []
+        duplicate_faces = 0
+        
+        for face_data in face_embeddings:
+            # Score against every student, present or not, so a present
+            # student's retake is never pushed onto the closest absent student
+            student_id, similarity = self.gallery.best_match(face_data['embedding'], set())
+            if not student_id:
+                continue
+            if student_id in self.matched_student_ids:
+                duplicate_faces += 1
+                continue
+            
+            self.matched_student_ids.add(student_id)
+            self.present_student_ids.append(student_id)
+            recognized_faces.append(RecognizedFace(
+                student_id=student_id,
+                confidence=similarity,
+                bbox=face_data.get('bbox', [])
+            ))
+        
+        self.photos_processed += 1
+        self.updated_at = time.time()
+        return recognized_faces, duplicate_faces
+
+    def to_response(self) -> AttendanceSessionResponse:
+        return AttendanceSessionResponse(
+            session_id=self.session_id,
+            class_id=self.class_id,
+            date=self.date,
+            students=len(self.gallery),
+            present_student_ids=self.present_student_ids,
+            photos_processed=self.photos_processed
+        )
+
+
+# Attendance sessions keyed by session_id ("<class_id>:<date>")
+attendance_sessions: Dict[str, AttendanceSession] = {}
+
+
+def expire_attendance_sessions():
+    """Drop sessions that have been idle longer than SESSION_TTL_SECONDS"""
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    for session_id in [sid for sid, s in attendance_sessions.items() if s.updated_at < cutoff]:
+        del attendance_sessions[session_id]
+
+
+def get_attendance_session(session_id: str) -> AttendanceSession:
+    """Look up a live session, raising 404 if it does not exist or has expired"""
+    require_single_worker("Attendance sessions")
+    expire_attendance_sessions()
+    if session_id not in attendance_sessions:
+        raise HTTPException(status_code=404, detail=f"Attendance session '{session_id}' not found")
+    return attendance_sessions[session_id]
+
+
 def decode_base64_image(image_str: str) -> np.ndarray:
     """Decode base64 image string to numpy array"""
     import base64
@@ -223,12 +625,9 @@ def detect_faces_yolo(image: np.ndarray) -> List[dict]:
     Detect faces using YOLOv8-face
     Returns list of {bbox, region}
     """
-    results = yolo_face(image, conf=0.3, iou=0.5)[0]
-
     faces = []
 
-    for box in results.boxes:
-        x1, y1, x2, y2 = map(int, box.xyxy[0])
+    for x1, y1, x2, y2 in run_yolo(image):
 
         w, h = x2 - x1, y2 - y1
         if w < MIN_FACE_SIZE or h < MIN_FACE_SIZE:
@@ -303,7 +702,7 @@ def extract_arcface_embedding(face_img: np.ndarray, is_full_image: bool = False)
     
     # For full images (selfies), run InsightFace directly
     if is_full_image:
-        faces = arcface_app.get(face_img_bgr)
+        faces = run_insightface(face_img_bgr)
         if not faces or len(faces) == 0:
             raise ValueError("No face detected in the selfie image")
         # Return the largest face (most prominent)
@@ -350,7 +749,7 @@ def extract_arcface_embedding(face_img: np.ndarray, is_full_image: bool = False)
     mask = mask[:, :, np.newaxis] / 255.0
     
     # Try to extract embedding from the canvas
-    faces = arcface_app.get(canvas)
+    faces = run_insightface(canvas)
     
     if faces and len(faces) > 0:
         # Return the most centered face
@@ -372,7 +771,7 @@ def extract_arcface_embedding(face_img: np.ndarray, is_full_image: bool = False)
             cv2.BORDER_REPLICATE
         )
         
-        faces = arcface_app.get(padded)
+        faces = run_insightface(padded)
         if faces and len(faces) > 0:
             return faces[0].embedding
     
@@ -385,6 +784,49 @@ def extract_arcface_embedding(face_img: np.ndarray, is_full_image: bool = False)
 
 
 
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """L2 normalize one embedding or each row of a matrix of embeddings"""
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / (norms + 1e-8)
+
+
+def match_face_embeddings(
+    gallery: Gallery,
+    face_embeddings: Iterable[dict],
+    matched_student_ids: set
+) -> Iterator[RecognizedFace]:
+    """
+    Greedily match faces to students, one face per student
+
+    Faces are matched in order; each matched student is added to
+    matched_student_ids and skipped for the following faces.
+
+    Args:
+        gallery: enrolled students
+        face_embeddings: iterable of {embedding, bbox}
+        matched_student_ids: students already taken, updated in place
+
+    Yields:
+        RecognizedFace per face, with an empty student_id if unmatched
+    """
+    for face_data in face_embeddings:
+        student_id, similarity = gallery.best_match(face_data['embedding'], matched_student_ids)
+
+        if student_id:
+            matched_student_ids.add(student_id)
+            yield RecognizedFace(
+                student_id=student_id,
+                confidence=similarity,
+                bbox=face_data.get('bbox', [])
+            )
+        else:
+            yield RecognizedFace(
+                student_id="",
+                confidence=0.0,
+                bbox=face_data.get('bbox', [])
+            )
+
+
 def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
     """
     Calculate cosine similarity between two embeddings with L2 normalization
@@ -470,10 +912,22 @@ async def register_face(request: FaceRegistrationRequest):
         else:
             raise HTTPException(status_code=400, detail="No valid embeddings extracted")
         
+        # Check whether this face is already enrolled under another student
+        possible_duplicates = []
+        if request.gallery_id or request.stored_embeddings:
+            gallery = get_gallery(request.gallery_id, request.stored_embeddings)
+            matches = gallery.search(avg_embedding, DUPLICATE_TOP_K + 1, DUPLICATE_THRESHOLD)[0]
+            possible_duplicates = [
+                IdentityMatch(student_id=student_id, similarity=similarity)
+                for student_id, similarity in matches
+                if student_id != request.student_id
+            ][:DUPLICATE_TOP_K]
+        
         return FaceRegistrationResponse(
             student_id=request.student_id,
             embedding=embedding_list,
-            message=f"Successfully registered {len(embeddings)} face images"
+            message=f"Successfully registered {len(embeddings)} face images",
+            possible_duplicates=possible_duplicates
         )
     except HTTPException:
         raise
@@ -564,49 +1018,21 @@ async def match_faces(request: MatchFacesRequest):
             matched_faces=0
         )
     
-    # Convert stored embeddings to numpy arrays for efficient computation
-    stored_emb_dict = {}
-    for stored in request.stored_embeddings:
-        stored_emb_dict[stored.student_id] = np.array(stored.embedding)
+    # Stack stored embeddings into one normalized matrix for efficient computation
+    try:
+        gallery = Gallery(request.stored_embeddings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid stored embeddings: {str(e)}")
     
-    recognized_faces = []
     matched_student_ids = set()  # Prevent duplicate matches
     
     # Match each detected face with stored embeddings
-    for face_data in request.face_embeddings:
-        face_embedding = np.array(face_data['embedding'])
-        best_match = None
-        best_similarity = 0.0
-        
-        # Find best matching student for this face
-        for student_id, stored_embedding in stored_emb_dict.items():
-            # Skip if this student is already matched (one face = one student)
-            if student_id in matched_student_ids:
-                continue
-            
-            # Calculate cosine similarity
-            similarity = cosine_similarity(face_embedding, stored_embedding)
-            
-            # Update best match if similarity is higher and above threshold
-            if similarity > best_similarity and similarity >= SIMILARITY_THRESHOLD:
-                best_similarity = similarity
-                best_match = student_id
-        
-        # Add recognized face if match found
-        if best_match:
-            recognized_faces.append(RecognizedFace(
-                student_id=best_match,
-                confidence=best_similarity,
-                bbox=face_data.get('bbox', [])
-            ))
-            matched_student_ids.add(best_match)
-        else:
-            # Unmatched face
-            recognized_faces.append(RecognizedFace(
-                student_id="",
-                confidence=0.0,
-                bbox=face_data.get('bbox', [])
-            ))
+    try:
+        recognized_faces = list(match_face_embeddings(
+            gallery, request.face_embeddings, matched_student_ids
+        ))
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid face embeddings: {str(e)}")
     
     return RecognitionResponse(
         recognized_faces=recognized_faces,
@@ -615,6 +1041,198 @@ async def match_faces(request: MatchFacesRequest):
     )
 
 
+def decode_uploaded_image(contents: bytes) -> np.ndarray:
+    """Decode uploaded image bytes to a BGR numpy array, raising 400 on bad input"""
+    if not contents or len(contents) == 0:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    
+    nparr = np.frombuffer(contents, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    if image is None:
+        raise HTTPException(status_code=400, detail="Invalid image file. Could not decode image.")
+    
+    return image
+
+
+def detect_group_faces(image_bgr: np.ndarray) -> List[dict]:
+    """Run YOLO face detection on a BGR group photo, raising 400 on failure"""
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    try:
+        return detect_faces_yolo(image_rgb)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Face detection failed: {str(e)}"
+        )
+
+
+def find_insightface_match(yolo_bbox: List[int], insightface_faces: list, taken: set) -> Optional[int]:
+    """
+    Index of the InsightFace detection that best overlaps a YOLO box
+    
+    Args:
+        yolo_bbox: [x, y, w, h]
+        insightface_faces: faces from run_insightface, in the same coordinates
+        taken: indices already paired with another box
+    
+    Returns:
+        Index with IoU above 0.3, or None
+    """
+    best_match_idx = None
+    best_iou = 0.0
+    
+    for idx, if_face in enumerate(insightface_faces):
+        if idx in taken:
+            continue
+        
+        # Convert InsightFace bbox to [x, y, w, h] format
+        if_bbox = if_face.bbox  # InsightFace bbox is [x1, y1, x2, y2]
+        if_bbox_formatted = [
+            int(if_bbox[0]),
+            int(if_bbox[1]),
+            int(if_bbox[2] - if_bbox[0]),
+            int(if_bbox[3] - if_bbox[1])
+        ]
+        
+        iou = calculate_iou(yolo_bbox, if_bbox_formatted)
+        if iou > best_iou and iou > 0.3:  # Minimum IoU threshold
+            best_iou = iou
+            best_match_idx = idx
+    
+    return best_match_idx
+
+
+def iter_face_embeddings(image_bgr: np.ndarray, detected_faces: List[dict]) -> Iterator[dict]:
+    """
+    Embed each YOLO detection in a group photo
+    
+    InsightFace runs once on the full image and its faces are paired with
+    YOLO boxes by IoU; unpaired boxes fall back to cropped-face extraction.
+    Faces whose embedding cannot be extracted are skipped.
+    
+    Yields:
+        {embedding: np.ndarray, bbox: [x, y, w, h]} per embedded face
+    """
+    # Get all face embeddings from InsightFace on the full image
+    insightface_faces = run_insightface(image_bgr)
+    
+    # Match YOLO detections with InsightFace detections using IoU
+    matched_insightface_indices = set()
+    embedded_faces = 0
+    
+    for yolo_face in detected_faces:
+        yolo_bbox = yolo_face['bbox']  # [x, y, w, h]
+        best_match_idx = find_insightface_match(yolo_bbox, insightface_faces, matched_insightface_indices)
+        
+        # If we found a match, use InsightFace embedding
+        if best_match_idx is not None:
+            matched_insightface_indices.add(best_match_idx)
+            embedding = insightface_faces[best_match_idx].embedding
+        else:
+            # Fallback: try to extract embedding from cropped face
+            try:
+                embedding = extract_arcface_embedding(yolo_face['region'])
+            except Exception as e:
+                # Skip this face if embedding extraction fails
+                print(f"Warning: Failed to extract embedding for face at {yolo_bbox}: {str(e)}")
+                continue
+        
+        embedded_faces += 1
+        yield {
+            'embedding': embedding,
+            'bbox': yolo_bbox
+        }
+
+    print(
+        f"Detected faces: {len(detected_faces)}, "
+        f"InsightFace faces: {len(insightface_faces)}, "
+        f"Embeddings created: {embedded_faces}"
+    )
+
+
+def iter_face_embeddings_per_detection(image_bgr: np.ndarray, detected_faces: List[dict]) -> Iterator[dict]:
+    """
+    Embed YOLO detections one at a time, for streaming
+    
+    Instead of one InsightFace pass over the full image, InsightFace runs on
+    a window around each box (the box plus STREAM_CONTEXT_RATIO of its size
+    on every side), so each face is yielded as soon as it is embedded.
+    This costs one InsightFace detection pass per face, so the total time
+    is higher than iter_face_embeddings; the gain is time to first face.
+    Unpaired boxes fall back to cropped-face extraction as usual.
+    
+    Yields:
+        {embedding: np.ndarray, bbox: [x, y, w, h]} per embedded face
+    """
+    height, width = image_bgr.shape[:2]
+    
+    for yolo_face in detected_faces:
+        x, y, w, h = yolo_face['bbox']
+        pad_x, pad_y = int(w * STREAM_CONTEXT_RATIO), int(h * STREAM_CONTEXT_RATIO)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+        
+        window_faces = run_insightface(image_bgr[y0:y1, x0:x1])
+        match_idx = find_insightface_match([x - x0, y - y0, w, h], window_faces, set())
+        
+        if match_idx is not None:
+            embedding = window_faces[match_idx].embedding
+        else:
+            # Fallback: try to extract embedding from cropped face
+            try:
+                embedding = extract_arcface_embedding(yolo_face['region'])
+            except Exception as e:
+                # Skip this face if embedding extraction fails
+                print(f"Warning: Failed to extract embedding for face at {yolo_face['bbox']}: {str(e)}")
+                continue
+        
+        yield {
+            'embedding': embedding,
+            'bbox': yolo_face['bbox']
+        }
+
+
+def get_gallery(gallery_id: Optional[str], stored_embeddings: Optional[List[StoredEmbedding]]) -> Gallery:
+    """
+    Look up a cached gallery by id, or build one from inline stored embeddings
+    Raises 404 for an unknown gallery_id and 400 if neither is given
+    """
+    if gallery_id:
+        require_single_worker("Cached galleries")
+        if gallery_id not in galleries:
+            raise HTTPException(status_code=404, detail=f"Gallery '{gallery_id}' not found")
+        return galleries[gallery_id]
+    
+    if not stored_embeddings:
+        raise HTTPException(status_code=400, detail="Either gallery_id or stored_embeddings is required")
+    
+    try:
+        return Gallery(stored_embeddings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid stored embeddings: {str(e)}")
+
+
+async def resolve_gallery(gallery_id: Optional[str], stored_embeddings: Optional[UploadFile]) -> Gallery:
+    """
+    Resolve the gallery for an attendance request
+    
+    Args:
+        gallery_id: id of a gallery cached with PUT /galleries/{gallery_id}
+        stored_embeddings: JSON file part with a list of {student_id, embedding},
+            used when gallery_id is not given. A file part rather than a text
+            field, since Starlette caps text fields at 1 MB (about 90 students)
+    """
+    if gallery_id or stored_embeddings is None:
+        return get_gallery(gallery_id, None)
+    
+    try:
+        request = GalleryRequest(stored_embeddings=json.loads(await stored_embeddings.read()))
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid stored_embeddings: {str(e)}")
+    return get_gallery(None, request.stored_embeddings)
+
+
 @app.post("/extract-face-embeddings")
 async def extract_face_embeddings(file: UploadFile = File(...)):
     """
@@ -626,26 +1244,10 @@ async def extract_face_embeddings(file: UploadFile = File(...)):
 
         print("Uploaded file size:", len(contents)) 
         
-        if not contents or len(contents) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
-        
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            raise HTTPException(status_code=400, detail="Invalid image file. Could not decode image.")
-        
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image_bgr = image  # Keep BGR for InsightFace
+        image_bgr = decode_uploaded_image(contents)  # Keep BGR for InsightFace
         
         # Detect faces with YOLO
-        try:
-            detected_faces = detect_faces_yolo(image_rgb)
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Face detection failed: {str(e)}"
-            )
+        detected_faces = detect_group_faces(image_bgr)
         
         if len(detected_faces) == 0:
             return {
@@ -654,63 +1256,13 @@ async def extract_face_embeddings(file: UploadFile = File(...)):
                 "embedded_faces": 0
             }
         
-        # Get all face embeddings from InsightFace on the full image
-        insightface_faces = arcface_app.get(image_bgr)
-        
-        # Match YOLO detections with InsightFace detections using IoU
-        face_data = []
-        matched_insightface_indices = set()
-        
-        for yolo_face in detected_faces:
-            yolo_bbox = yolo_face['bbox']  # [x, y, w, h]
-            best_match_idx = None
-            best_iou = 0.0
-            
-            # Find the InsightFace detection that best matches this YOLO detection
-            for idx, if_face in enumerate(insightface_faces):
-                if idx in matched_insightface_indices:
-                    continue
-                
-                # Convert InsightFace bbox to [x, y, w, h] format
-                if_bbox = if_face.bbox  # InsightFace bbox is [x1, y1, x2, y2]
-                if_bbox_formatted = [
-                    int(if_bbox[0]),
-                    int(if_bbox[1]),
-                    int(if_bbox[2] - if_bbox[0]),
-                    int(if_bbox[3] - if_bbox[1])
-                ]
-                
-                iou = calculate_iou(yolo_bbox, if_bbox_formatted)
-                if iou > best_iou and iou > 0.3:  # Minimum IoU threshold
-                    best_iou = iou
-                    best_match_idx = idx
-            
-            # If we found a match, use InsightFace embedding
-            if best_match_idx is not None:
-                matched_insightface_indices.add(best_match_idx)
-                embedding = insightface_faces[best_match_idx].embedding
-                face_data.append({
-                    'embedding': embedding.tolist(),
-                    'bbox': yolo_bbox
-                })
-            else:
-                # Fallback: try to extract embedding from cropped face
-                try:
-                    embedding = extract_arcface_embedding(yolo_face['region'])
-                    face_data.append({
-                        'embedding': embedding.tolist(),
-                        'bbox': yolo_bbox
-                    })
-                except Exception as e:
-                    # Skip this face if embedding extraction fails
-                    print(f"Warning: Failed to extract embedding for face at {yolo_bbox}: {str(e)}")
-                    continue
-
-        print(
-            f"Detected faces: {len(detected_faces)}, "
-            f"InsightFace faces: {len(insightface_faces)}, "
-            f"Embeddings created: {len(face_data)}"
-        )
+        face_data = [
+            {
+                'embedding': face['embedding'].tolist(),
+                'bbox': face['bbox']
+            }
+            for face in iter_face_embeddings(image_bgr, detected_faces)
+        ]
         
         return {
             "faces": face_data,
@@ -727,6 +1279,252 @@ async def extract_face_embeddings(file: UploadFile = File(...)):
         )
 
 
+@app.put("/galleries/{gallery_id}", response_model=GalleryResponse)
+async def put_gallery(gallery_id: str, request: GalleryRequest):
+    """
+    Cache a class gallery so attendance requests can reference it by id
+    Replaces any gallery already stored under gallery_id
+    """
+    require_single_worker("Cached galleries")
+    try:
+        gallery = Gallery(request.stored_embeddings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid stored embeddings: {str(e)}")
+    
+    galleries[gallery_id] = gallery
+    return GalleryResponse(gallery_id=gallery_id, students=len(gallery))
+
+
+@app.delete("/galleries/{gallery_id}")
+async def delete_gallery(gallery_id: str):
+    """Remove a cached gallery"""
+    require_single_worker("Cached galleries")
+    if galleries.pop(gallery_id, None) is None:
+        raise HTTPException(status_code=404, detail=f"Gallery '{gallery_id}' not found")
+    return {"gallery_id": gallery_id, "deleted": True}
+
+
+@app.post("/recognize-attendance", response_model=RecognitionResponse)
+async def recognize_attendance(
+    file: UploadFile = File(...),
+    gallery_id: Optional[str] = Form(None),
+    stored_embeddings: Optional[UploadFile] = File(None)
+):
+    """
+    Detect, embed and match all faces in a group photo in one call
+    
+    Flow:
+    1. Decode the photo and detect faces with YOLO
+    2. Embed each face (InsightFace on the full image, crop fallback)
+    3. Match each face against the gallery, one face per student
+    
+    The gallery is either a cached gallery_id or a stored_embeddings JSON
+    file part in the same shape as /match-faces. Face embeddings never
+    leave the service.
+    """
+    try:
+        gallery = await resolve_gallery(gallery_id, stored_embeddings)
+        image_bgr = decode_uploaded_image(await file.read())
+        detected_faces = detect_group_faces(image_bgr)
+        
+        matched_student_ids = set()
+        faces = iter_face_embeddings(image_bgr, detected_faces) if detected_faces else []
+        recognized_faces = list(match_face_embeddings(gallery, faces, matched_student_ids))
+        
+        return RecognitionResponse(
+            recognized_faces=recognized_faces,
+            total_faces_detected=len(detected_faces),
+            matched_faces=len(matched_student_ids)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing image: {str(e)}"
+        )
+
+
+@app.post("/recognize-attendance/stream")
+async def recognize_attendance_stream(
+    file: UploadFile = File(...),
+    gallery_id: Optional[str] = Form(None),
+    stored_embeddings: Optional[UploadFile] = File(None)
+):
+    """
+    Streaming variant of /recognize-attendance
+    
+    Returns newline-delimited JSON: one {"type": "face", ...RecognizedFace}
+    line per face as soon as it is embedded and matched, then a final
+    {"type": "summary", total_faces_detected, matched_faces} line.
+    Faces are embedded one detection at a time, so the first line arrives
+    after one face's work rather than the whole photo's, at the cost of a
+    longer total time than /recognize-attendance.
+    Input errors are reported as normal HTTP errors before streaming starts.
+    """
+    gallery = await resolve_gallery(gallery_id, stored_embeddings)
+    image_bgr = decode_uploaded_image(await file.read())
+    detected_faces = detect_group_faces(image_bgr)
+    
+    def generate() -> Iterator[str]:
+        matched_student_ids = set()
+        faces = iter_face_embeddings_per_detection(image_bgr, detected_faces)
+        try:
+            for face in match_face_embeddings(gallery, faces, matched_student_ids):
+                yield json.dumps({"type": "face", **face.model_dump()}) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": f"Error processing image: {str(e)}"}) + "\n"
+            return
+        
+        yield json.dumps({
+            "type": "summary",
+            "total_faces_detected": len(detected_faces),
+            "matched_faces": len(matched_student_ids)
+        }) + "\n"
+    
+    # A sync generator runs in the threadpool, keeping inference off the event loop
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def check_similarity_threshold(threshold: float):
+    """Reject thresholds at or below 0.5 (cosine <= 0), which match nearly every student, or above 1"""
+    if not 0.5 < threshold <= 1.0:
+        raise HTTPException(status_code=400, detail="threshold must be greater than 0.5 and at most 1")
+
+
+@app.post("/identity-search", response_model=IdentitySearchResponse)
+def identity_search(request: IdentitySearchRequest):
+    """
+    Find enrolled students similar to each query embedding
+    
+    Used for "is this face already enrolled" checks, e.g. with the embedding
+    returned by /register-face against a school-wide gallery. All queries
+    are scored in one blocked matrix product. Declared with plain def so
+    FastAPI runs it in its threadpool instead of blocking the event loop.
+    """
+    check_similarity_threshold(request.threshold)
+    if not 1 <= request.top_k <= MAX_IDENTITY_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {MAX_IDENTITY_TOP_K}")
+    
+    gallery = get_gallery(request.gallery_id, request.stored_embeddings)
+    if len(request.embeddings) == 0:
+        return IdentitySearchResponse(results=[])
+    
+    try:
+        results = gallery.search(np.array(request.embeddings), request.top_k, request.threshold)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid embeddings: {str(e)}")
+    
+    return IdentitySearchResponse(results=[
+        IdentitySearchResult(matches=[
+            IdentityMatch(student_id=student_id, similarity=similarity)
+            for student_id, similarity in matches
+        ])
+        for matches in results
+    ])
+
+
+@app.post("/duplicate-report", response_model=DuplicateReportResponse)
+def duplicate_report(request: DuplicateReportRequest):
+    """
+    Report every pair of enrolled students whose embeddings are near-duplicates
+    
+    Catches the same person enrolled under several roll numbers or classes.
+    The all-pairs comparison is done in (block_size x block_size) tiles, so
+    memory stays bounded for large schools. Like /identity-search it is a
+    plain def, so the seconds-long scan runs in the threadpool.
+    """
+    check_similarity_threshold(request.threshold)
+    # One tile holds block_size^2 similarities, so the block size bounds the report's memory
+    if not 1 <= request.block_size <= MAX_GALLERY_BLOCK_SIZE:
+        raise HTTPException(status_code=400, detail=f"block_size must be between 1 and {MAX_GALLERY_BLOCK_SIZE}")
+    if request.max_pairs <= 0:
+        raise HTTPException(status_code=400, detail="max_pairs must be positive")
+    
+    gallery = get_gallery(request.gallery_id, request.stored_embeddings)
+    start = time.perf_counter()
+    pairs, truncated = gallery.duplicate_pairs(request.threshold, request.block_size, request.max_pairs)
+    
+    return DuplicateReportResponse(
+        students=len(gallery),
+        pairs=[
+            DuplicatePair(student_id_a=a, student_id_b=b, similarity=similarity)
+            for a, b, similarity in pairs
+        ],
+        truncated=truncated,
+        elapsed_seconds=time.perf_counter() - start
+    )
+
+
+@app.post("/attendance-sessions", response_model=AttendanceSessionResponse)
+async def create_attendance_session(request: AttendanceSessionRequest):
+    """
+    Start an attendance session for a class and date
+    
+    The session id is "<class_id>:<date>". If a live session already exists
+    for that class and date it is returned unchanged, so retries are safe.
+    The gallery is either a cached gallery_id or inline stored_embeddings.
+    """
+    require_single_worker("Attendance sessions")
+    expire_attendance_sessions()
+    session_id = f"{request.class_id}:{request.date}"
+    if session_id in attendance_sessions:
+        return attendance_sessions[session_id].to_response()
+    
+    gallery = get_gallery(request.gallery_id, request.stored_embeddings)
+    session = AttendanceSession(session_id, request.class_id, request.date, gallery)
+    attendance_sessions[session_id] = session
+    return session.to_response()
+
+
+@app.get("/attendance-sessions/{session_id}", response_model=AttendanceSessionResponse)
+async def get_attendance_session_state(session_id: str):
+    """Return the students marked present so far"""
+    return get_attendance_session(session_id).to_response()
+
+
+@app.delete("/attendance-sessions/{session_id}")
+async def delete_attendance_session(session_id: str):
+    """End an attendance session"""
+    get_attendance_session(session_id)
+    del attendance_sessions[session_id]
+    return {"session_id": session_id, "deleted": True}
+
+
+@app.post("/attendance-sessions/{session_id}/photos", response_model=SessionPhotoResponse)
+async def add_attendance_session_photo(session_id: str, file: UploadFile = File(...)):
+    """
+    Recognize a further photo of the class, e.g. a retake
+    
+    Every face is scored against the whole class. A face whose best match is
+    a student already present counts as a duplicate, and only faces whose
+    best match is still absent mark a new student present. Only the newly
+    matched faces are returned.
+    """
+    session = get_attendance_session(session_id)
+    try:
+        image_bgr = decode_uploaded_image(await file.read())
+        detected_faces = detect_group_faces(image_bgr)
+        
+        faces = iter_face_embeddings(image_bgr, detected_faces) if detected_faces else []
+        recognized_faces, duplicate_faces = session.add_photo(faces)
+        
+        return SessionPhotoResponse(
+            recognized_faces=recognized_faces,
+            total_faces_detected=len(detected_faces),
+            matched_faces=len(recognized_faces),
+            duplicate_faces=duplicate_faces,
+            present_student_ids=session.present_student_ids
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing image: {str(e)}"
+        )
+
+
 @app.post("/register-face-debug")
 async def register_face_debug(request: dict):
     """Debug endpoint to see what's being received"""
@@ -745,7 +1543,12 @@ async def register_face_debug(request: dict):
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "ai-attendance"}
+    return {
+        "status": "healthy",
+        "service": "ai-attendance",
+        "models": "model-host" if model_host else "local",
+        "workers": WORKER_COUNT
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,4 @@
+"""
+Offline CPU benchmarks for the AI service
+Run from the ai-service directory: python -m benchmarks.run --faces-dir <dir>
+"""
@@ -0,0 +1,625 @@
+"""
+Benchmark and load-test runner for the AI service
+
+Measures per-stage and end-to-end latency, throughput and memory for
+/extract-face-embeddings, /match-faces, /recognize-attendance and
+/register-face using synthetic classroom photos and galleries. Per-stage
+timings run in-process on CPU against the ASGI app, so no server is needed.
+The concurrent-client load phase runs against a real server (uvicorn or
+serve.py) given with --base-url, since in-process requests to blocking
+endpoints are handled one at a time on a single event loop.
+
+Memory per stage is the tracemalloc peak of one extra, untimed run of that
+stage (Python objects and NumPy buffers; native ONNX Runtime / PyTorch
+allocations are not traced). The all-pairs duplicate report runs once,
+timed and traced together. Process-wide peak RSS is reported once, at
+startup and at the end, since it never decreases.
+
+Model memory shows up in the load phase instead: with --server-pid, the RSS
+of the server process and all its children (uvicorn workers, model host) is
+sampled from /proc while each endpoint is under load. This is Linux only.
+
+Usage (from the ai-service directory):
+    python -m benchmarks.run --faces-dir ./faces --output bench.json
+    python -m benchmarks.run --faces-dir ./faces --skip pipeline,matching,register,duplicates \
+        --base-url http://127.0.0.1:8000 --server-pid <pid of uvicorn or serve.py>
+"""
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+import cv2
+import httpx
+
+from benchmarks import synthetic
+
+
+# Set from --no-memory; skips the extra traced run of each stage
+TRACE_MEMORY = True
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return usage / (1024 * 1024)
+    return usage / 1024
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in seconds"""
+    values = np.array(samples, dtype=np.float64)
+    return {
+        "min": float(values.min()),
+        "median": float(np.median(values)),
+        "p95": float(np.percentile(values, 95)),
+        "mean": float(values.mean()),
+        "samples": len(samples)
+    }
+
+
+def traced_peak_mb(fn: Callable[[], object]) -> Tuple[float, object]:
+    """Peak memory allocated while fn runs, in MB, and its result"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024), result
+
+
+async def atraced_peak_mb(fn: Callable[[], Awaitable[object]]) -> Tuple[float, object]:
+    """Peak memory allocated while an async fn runs, in MB, and its result"""
+    tracemalloc.start()
+    try:
+        result = await fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024), result
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Tuple[Dict[str, float], object, Optional[float]]:
+    """
+    Time a synchronous callable repeat times, then trace one extra run
+
+    Returns:
+        (latency summary, last result, traced peak MB or None)
+    """
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    memory = traced_peak_mb(fn)[0] if TRACE_MEMORY else None
+    return summarize(samples), result, memory
+
+
+async def ameasure(
+    fn: Callable[[], Awaitable[object]],
+    repeat: int
+) -> Tuple[Dict[str, float], object, Optional[float]]:
+    """Async version of measure"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await fn()
+        samples.append(time.perf_counter() - start)
+    memory = (await atraced_peak_mb(fn))[0] if TRACE_MEMORY else None
+    return summarize(samples), result, memory
+
+
+def record(name: str, latency: Optional[Dict[str, float]], memory_mb: Optional[float], **fields) -> dict:
+    """Build one result entry with the stage's own traced memory peak (latency None if nothing succeeded)"""
+    entry = {"name": name, "latency_s": latency, "traced_peak_mb": memory_mb}
+    entry.update(fields)
+    memory = f"{memory_mb:8.1f} MB" if memory_mb is not None else "       -"
+    if latency is None:
+        print(f"  {name:<28} no successful requests")
+    else:
+        print(f"  {name:<28} median {latency['median'] * 1000:10.2f} ms  "
+              f"p95 {latency['p95'] * 1000:10.2f} ms  mem {memory}")
+    return entry
+
+
+def process_tree(pid: int) -> List[int]:
+    """pid and all its descendants, from /proc"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Fields after the parenthesized command name: state, ppid, ...
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def proc_status_mb(pid: int, field: str) -> float:
+    """A memory field of /proc/<pid>/status (e.g. VmRSS, VmHWM) in MB, 0 if the process is gone"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class ServerMemorySampler:
+    """
+    Samples the summed RSS of a server process tree in a background thread
+
+    Use as a context manager around a load run. peak_rss_mb is the highest
+    total seen while it ran; hwm_mb sums each process's own peak (VmHWM)
+    since it started, read on exit. Shared pages are counted once per process.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self.hwm_mb = 0.0
+        self.processes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> List[int]:
+        pids = process_tree(self.pid)
+        self.peak_rss_mb = max(self.peak_rss_mb, sum(proc_status_mb(p, "VmRSS") for p in pids))
+        return pids
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "ServerMemorySampler":
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        pids = self._sample()
+        self.processes = len(pids)
+        self.hwm_mb = sum(proc_status_mb(p, "VmHWM") for p in pids)
+
+
+def git_commit() -> str:
+    """Current commit hash, so results can be compared across commits"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return ""
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """Parse WIDTHxHEIGHT"""
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+async def post_photo(client: httpx.AsyncClient, path: str, photo: bytes) -> httpx.Response:
+    response = await client.post(path, files={"file": ("group-photo.jpg", photo, "image/jpeg")})
+    response.raise_for_status()
+    return response
+
+
+async def post_json(client: httpx.AsyncClient, path: str, payload: dict) -> httpx.Response:
+    response = await client.post(path, json=payload)
+    response.raise_for_status()
+    return response
+
+
+async def bench_pipeline(service, client, faces, args, rng) -> List[dict]:
+    """Per-stage and end-to-end timings for /extract-face-embeddings and /recognize-attendance"""
+    gallery = synthetic.make_gallery(args.load_gallery_size, rng)
+    stored_embeddings = json.dumps(synthetic.gallery_payload(gallery))
+
+    results = []
+    for resolution in args.resolutions:
+        for face_size in args.face_sizes:
+            for n_faces in args.face_counts:
+                image_rgb, _ = synthetic.make_group_photo(faces, n_faces, face_size, resolution, rng)
+                photo = synthetic.encode_jpeg(image_rgb)
+                params = {
+                    "resolution": list(resolution),
+                    "face_size": face_size,
+                    "faces_placed": n_faces,
+                    "photo_bytes": len(photo)
+                }
+                print(f"pipeline {resolution[0]}x{resolution[1]} face={face_size}px n={n_faces}")
+
+                def decode():
+                    image = cv2.imdecode(np.frombuffer(photo, np.uint8), cv2.IMREAD_COLOR)
+                    return image, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+                latency, (image_bgr, image_rgb), memory = measure(decode, args.repeat)
+                results.append(record("decode", latency, memory, **params))
+
+                latency, detected, memory = measure(lambda: service.detect_faces_yolo(image_rgb), args.repeat)
+                results.append(record("detect_yolo", latency, memory, faces_detected=len(detected), **params))
+
+                latency, if_faces, memory = measure(lambda: service.run_insightface(image_bgr), args.repeat)
+                results.append(record("insightface_full_image", latency, memory, faces_detected=len(if_faces), **params))
+
+                def embed_crops():
+                    embedded = 0
+                    for face in detected:
+                        try:
+                            service.extract_arcface_embedding(face["region"])
+                            embedded += 1
+                        except ValueError:
+                            continue
+                    return embedded
+
+                if detected:
+                    latency, embedded, memory = measure(embed_crops, args.repeat)
+                    results.append(record(
+                        "embed_crops", latency, memory,
+                        faces_embedded=embedded,
+                        per_face_s=latency["median"] / len(detected),
+                        **params
+                    ))
+
+                latency, response, memory = await ameasure(
+                    lambda: post_photo(client, "/extract-face-embeddings", photo), args.repeat
+                )
+                body = response.json()
+                results.append(record(
+                    "extract_face_embeddings_e2e", latency, memory,
+                    faces_detected=body["total_faces"],
+                    faces_embedded=body["embedded_faces"],
+                    faces_per_s=body["embedded_faces"] / latency["median"] if latency["median"] else 0.0,
+                    **params
+                ))
+
+                async def recognize():
+                    response = await client.post(
+                        "/recognize-attendance",
+                        files={
+                            "file": ("group-photo.jpg", photo, "image/jpeg"),
+                            "stored_embeddings": ("stored-embeddings.json", stored_embeddings, "application/json")
+                        }
+                    )
+                    response.raise_for_status()
+                    return response
+
+                latency, response, memory = await ameasure(recognize, args.repeat)
+                results.append(record(
+                    "recognize_attendance_e2e", latency, memory,
+                    gallery_size=args.load_gallery_size,
+                    matched_faces=response.json()["matched_faces"],
+                    **params
+                ))
+    return results
+
+
+async def bench_matching(service, client, args, rng) -> List[dict]:
+    """Request parsing, matching and end-to-end timings for /match-faces"""
+    results = []
+    for gallery_size in args.gallery_sizes:
+        gallery = synthetic.make_gallery(gallery_size, rng)
+        stored = synthetic.gallery_payload(gallery)
+        for n_faces in args.face_counts:
+            probes = synthetic.make_probe_embeddings(gallery, n_faces, rng)
+            payload = {
+                "stored_embeddings": stored,
+                "face_embeddings": [
+                    {"embedding": p.tolist(), "bbox": [0, 0, 0, 0]} for p in probes
+                ]
+            }
+            params = {"gallery_size": gallery_size, "faces": n_faces}
+            print(f"matching gallery={gallery_size} faces={n_faces}")
+
+            latency, request, memory = measure(lambda: service.MatchFacesRequest(**payload), args.repeat)
+            results.append(record("match_parse_request", latency, memory, **params))
+
+            latency, response, memory = await ameasure(lambda: service.match_faces(request), args.repeat)
+            results.append(record(
+                "match_faces", latency, memory,
+                matched_faces=response.matched_faces,
+                comparisons_per_s=gallery_size * n_faces / latency["median"] if latency["median"] else 0.0,
+                **params
+            ))
+
+            if gallery_size <= args.http_gallery_max:
+                latency, _, memory = await ameasure(lambda: post_json(client, "/match-faces", payload), args.repeat)
+                results.append(record("match_faces_e2e", latency, memory, **params))
+
+        del stored
+    return results
+
+
+async def bench_register(service, client, faces, args, rng) -> List[dict]:
+    """Per-selfie extraction and end-to-end timings for /register-face"""
+    selfies = [synthetic.make_selfie(faces[int(rng.integers(len(faces)))]) for _ in range(3)]
+    payload = {
+        "student_id": "STU000000",
+        "images": [synthetic.encode_base64_jpeg(s) for s in selfies]
+    }
+    print("register 3 selfies")
+
+    results = []
+    latency, _, memory = measure(lambda: service.decode_base64_image(payload["images"][0]), args.repeat)
+    results.append(record("register_decode_base64", latency, memory))
+
+    latency, _, memory = measure(
+        lambda: service.extract_arcface_embedding(selfies[0], is_full_image=True), args.repeat
+    )
+    results.append(record("register_embed_selfie", latency, memory))
+
+    latency, _, memory = await ameasure(lambda: post_json(client, "/register-face", payload), args.repeat)
+    results.append(record("register_face_e2e", latency, memory, images=len(selfies)))
+    return results
+
+
+def bench_duplicates(service, args, rng) -> List[dict]:
+    """Gallery build, batched identity search and blocked all-pairs duplicate report"""
+    results = []
+    for gallery_size in args.duplicate_sizes:
+        print(f"duplicates gallery={gallery_size} block={args.block_size}")
+        gallery = synthetic.make_gallery(gallery_size, rng)
+        # Plant near-duplicate enrollments (same person under two roll numbers)
+        planted = min(args.planted_duplicates, gallery_size // 2)
+        sources = rng.choice(gallery_size, size=2 * planted, replace=False)
+        gallery[sources[planted:]] = synthetic.make_probe_embeddings(
+            gallery[sources[:planted]], planted, rng, noise=0.3, present_ratio=1.0
+        )
+        stored = [
+            service.StoredEmbedding(student_id=f"STU{i:06d}", embedding=row)
+            for i, row in enumerate(gallery.tolist())
+        ]
+        params = {"gallery_size": gallery_size, "block_size": args.block_size}
+
+        latency, indexed, memory = measure(lambda: service.Gallery(stored), 1)
+        results.append(record("gallery_build", latency, memory, **params))
+        del stored
+
+        queries = synthetic.make_probe_embeddings(gallery, 100, rng)
+        latency, _, memory = measure(
+            lambda: indexed.search(queries, service.DUPLICATE_TOP_K, service.DUPLICATE_THRESHOLD, args.block_size),
+            args.repeat
+        )
+        results.append(record("identity_search_100_queries", latency, memory, **params))
+
+        # A single run, timed and traced together: the scan takes seconds at school scale
+        # and its peak (tiles plus found pairs) is what block_size is meant to bound
+        def report():
+            return indexed.duplicate_pairs(service.DUPLICATE_THRESHOLD, args.block_size, service.DUPLICATE_MAX_PAIRS)
+
+        start = time.perf_counter()
+        if TRACE_MEMORY:
+            memory, (pairs, truncated) = traced_peak_mb(report)
+        else:
+            memory, (pairs, truncated) = None, report()
+        latency = summarize([time.perf_counter() - start])
+        results.append(record(
+            "duplicate_report_all_pairs", latency, memory,
+            pairs_found=len(pairs),
+            truncated=truncated,
+            pairs_planted=planted,
+            pairs_compared=gallery_size * (gallery_size - 1) // 2,
+            **params
+        ))
+    return results
+
+
+async def run_load(
+    name: str,
+    client: httpx.AsyncClient,
+    request_fn: Callable[[], Awaitable[httpx.Response]],
+    concurrency: int,
+    requests_per_client: int,
+    server_pid: Optional[int] = None
+) -> dict:
+    """Fire requests from concurrent clients and report latency, throughput and server memory"""
+    samples: List[float] = []
+    errors = 0
+
+    async def client_loop():
+        nonlocal errors
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            try:
+                await request_fn()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - start)
+
+    sampler = ServerMemorySampler(server_pid) if server_pid else None
+    start = time.perf_counter()
+    if sampler:
+        with sampler:
+            await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    else:
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    entry = record(
+        name,
+        summarize(samples) if samples else None,
+        None,  # tracemalloc cannot see into the server; see server_* fields
+        server_peak_rss_mb=sampler.peak_rss_mb if sampler else None,
+        server_hwm_mb=sampler.hwm_mb if sampler else None,
+        server_processes=sampler.processes if sampler else None,
+        concurrency=concurrency,
+        requests=len(samples),
+        errors=errors,
+        wall_s=wall,
+        base_url=str(client.base_url),
+        requests_per_s=len(samples) / wall if wall else 0.0
+    )
+    if sampler:
+        print(f"  {'':<28} server RSS peak {sampler.peak_rss_mb:8.1f} MB across {sampler.processes} processes")
+    return entry
+
+
+async def bench_load(client, faces, args, rng) -> List[dict]:
+    """Concurrent-client load against all three endpoints of the server at --base-url"""
+    image_rgb, _ = synthetic.make_group_photo(
+        faces, args.load_faces, args.face_sizes[0], args.resolutions[0], rng
+    )
+    photo = synthetic.encode_jpeg(image_rgb)
+
+    gallery = synthetic.make_gallery(args.load_gallery_size, rng)
+    probes = synthetic.make_probe_embeddings(gallery, args.load_faces, rng)
+    match_payload = {
+        "stored_embeddings": synthetic.gallery_payload(gallery),
+        "face_embeddings": [{"embedding": p.tolist(), "bbox": [0, 0, 0, 0]} for p in probes]
+    }
+    register_payload = {
+        "student_id": "STU000000",
+        "images": [
+            synthetic.encode_base64_jpeg(synthetic.make_selfie(faces[i % len(faces)]))
+            for i in range(3)
+        ]
+    }
+
+    endpoints = [
+        ("load_extract_face_embeddings", lambda: post_photo(client, "/extract-face-embeddings", photo)),
+        ("load_match_faces", lambda: post_json(client, "/match-faces", match_payload)),
+        ("load_register_face", lambda: post_json(client, "/register-face", register_payload)),
+    ]
+
+    results = []
+    for concurrency in args.concurrency:
+        print(f"load concurrency={concurrency}")
+        for name, request_fn in endpoints:
+            results.append(await run_load(
+                name, client, request_fn, concurrency, args.load_requests, args.server_pid
+            ))
+    return results
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the AI attendance service on CPU")
+    parser.add_argument("--faces-dir", required=True,
+                        help="Directory of single-face images used to composite synthetic photos")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write JSON results")
+    parser.add_argument("--face-counts", type=int_list, default=[5, 20, 40])
+    parser.add_argument("--face-sizes", type=int_list, default=[48, 96, 160])
+    parser.add_argument("--resolutions", type=lambda v: [parse_resolution(r) for r in v.split(",")],
+                        default=[(1280, 720), (1920, 1080), (4032, 3024)])
+    parser.add_argument("--gallery-sizes", type=int_list, default=[40, 1000, 10000, 100000])
+    parser.add_argument("--http-gallery-max", type=int, default=10000,
+                        help="Largest gallery sent over HTTP to /match-faces (JSON bodies grow quickly)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the extra tracemalloc run used to measure each stage's memory")
+    parser.add_argument("--base-url", default=None,
+                        help="Server to send the load phase to, e.g. http://127.0.0.1:8000 (load is skipped without it)")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="PID of the server at --base-url (uvicorn or serve.py); samples its process tree's RSS (Linux)")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 8])
+    parser.add_argument("--load-requests", type=int, default=4, help="Requests per concurrent client")
+    parser.add_argument("--load-faces", type=int, default=20)
+    parser.add_argument("--load-gallery-size", type=int, default=40,
+                        help="Gallery size for load tests and /recognize-attendance")
+    parser.add_argument("--duplicate-sizes", type=int_list, default=[50000],
+                        help="Gallery sizes for the all-pairs duplicate report")
+    parser.add_argument("--planted-duplicates", type=int, default=100)
+    parser.add_argument("--block-size", type=int, default=4096,
+                        help="Block size for identity search and the duplicate report")
+    parser.add_argument("--skip", type=lambda v: set(v.split(",")), default=set(),
+                        help="Comma-separated suites to skip: pipeline,matching,register,duplicates,load")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.server_pid and not os.path.isdir("/proc"):
+        parser.error("--server-pid needs /proc (Linux)")
+    return args
+
+
+async def main(argv=None):
+    global TRACE_MEMORY
+    args = parse_args(argv)
+    TRACE_MEMORY = not args.no_memory
+    rng = np.random.default_rng(args.seed)
+    faces = synthetic.load_face_set(args.faces_dir)
+
+    output = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__
+        },
+        "config": {k: (sorted(v) if isinstance(v, set) else v) for k, v in vars(args).items()},
+        "results": {}
+    }
+
+    in_process = [name for name in ("pipeline", "matching", "register", "duplicates") if name not in args.skip]
+    if in_process:
+        rss_before_models = peak_rss_mb()
+        start = time.perf_counter()
+        import app as service  # Loads YOLO and buffalo_l models, unless MODEL_HOST_ADDRESS is set
+        output["startup"] = {
+            "model_load_s": time.perf_counter() - start,
+            "rss_before_models_mb": rss_before_models,
+            "rss_after_models_mb": peak_rss_mb()
+        }
+
+        transport = httpx.ASGITransport(app=service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if "pipeline" in in_process:
+                output["results"]["pipeline"] = await bench_pipeline(service, client, faces, args, rng)
+            if "matching" in in_process:
+                output["results"]["matching"] = await bench_matching(service, client, args, rng)
+            if "register" in in_process:
+                output["results"]["register"] = await bench_register(service, client, faces, args, rng)
+            if "duplicates" in in_process:
+                output["results"]["duplicates"] = bench_duplicates(service, args, rng)
+
+    if "load" not in args.skip:
+        if args.base_url:
+            async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+                output["results"]["load"] = await bench_load(client, faces, args, rng)
+        else:
+            print("Skipping load phase: pass --base-url to load-test a running server")
+
+    output["peak_rss_mb"] = peak_rss_mb()
+
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""
+Synthetic data generators for benchmarks
+Builds classroom group photos from a local face set and random embedding galleries
+"""
+from typing import List, Tuple
+import base64
+import os
+import numpy as np
+import cv2
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+EMBEDDING_DIM = 512  # ArcFace (buffalo_l) embedding size
+
+
+def load_face_set(faces_dir: str) -> List[np.ndarray]:
+    """
+    Load every image in faces_dir as an RGB array
+    Each image should contain a single, roughly centered face
+    """
+    faces = []
+    for name in sorted(os.listdir(faces_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(faces_dir, name), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        faces.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    if len(faces) == 0:
+        raise ValueError(f"No readable face images found in {faces_dir}")
+
+    return faces
+
+
+def make_background(width: int, height: int, rng: np.random.Generator) -> np.ndarray:
+    """Create a noisy gradient background, roughly like a classroom wall"""
+    base = rng.integers(60, 200, size=3)
+    gradient = np.linspace(0.7, 1.0, height, dtype=np.float32)[:, None, None]
+    background = np.ones((height, width, 3), dtype=np.float32) * base * gradient
+    background += rng.normal(0, 8, size=background.shape)
+    return np.clip(background, 0, 255).astype(np.uint8)
+
+
+def make_group_photo(
+    faces: List[np.ndarray],
+    n_faces: int,
+    face_size: int,
+    resolution: Tuple[int, int],
+    rng: np.random.Generator
+) -> Tuple[np.ndarray, List[List[int]]]:
+    """
+    Composite n_faces faces from the face set onto one RGB image
+
+    Faces are laid out on a jittered grid so they never overlap.
+    Grid cells are shrunk if n_faces does not fit at the requested size.
+
+    Args:
+        faces: face set from load_face_set
+        n_faces: number of faces to place
+        face_size: target face width in pixels
+        resolution: (width, height) of the output image
+
+    Returns:
+        (image, bboxes) with bboxes in [x, y, width, height] format
+    """
+    width, height = resolution
+    image = make_background(width, height, rng)
+
+    cols = max(1, int(np.ceil(np.sqrt(n_faces * width / height))))
+    rows = int(np.ceil(n_faces / cols))
+    cell_w, cell_h = width // cols, height // rows
+    size = max(8, min(face_size, int(cell_w * 0.8), int(cell_h * 0.8)))
+
+    bboxes = []
+    for i in range(n_faces):
+        face = faces[int(rng.integers(len(faces)))]
+        h, w = face.shape[:2]
+        scale = size / w
+        face = cv2.resize(face, (size, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        fh, fw = face.shape[:2]
+        fh = min(fh, cell_h)
+        face = face[:fh]
+
+        row, col = divmod(i, cols)
+        x = col * cell_w + int(rng.integers(0, max(1, cell_w - fw + 1)))
+        y = row * cell_h + int(rng.integers(0, max(1, cell_h - fh + 1)))
+        image[y:y+fh, x:x+fw] = face
+        bboxes.append([x, y, fw, fh])
+
+    return image, bboxes
+
+
+def make_selfie(face: np.ndarray, size: int = 640) -> np.ndarray:
+    """Center a face on a plain square canvas, like a registration selfie"""
+    h, w = face.shape[:2]
+    scale = (size * 0.6) / max(h, w)
+    face = cv2.resize(face, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_CUBIC)
+    h, w = face.shape[:2]
+
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    canvas[:] = face.mean(axis=(0, 1)).astype(np.uint8)
+    y, x = (size - h) // 2, (size - w) // 2
+    canvas[y:y+h, x:x+w] = face
+    return canvas
+
+
+def encode_jpeg(image_rgb: np.ndarray, quality: int = 90) -> bytes:
+    """Encode an RGB image to JPEG bytes, as uploaded by the backend"""
+    ok, buffer = cv2.imencode(
+        ".jpg",
+        cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR),
+        [cv2.IMWRITE_JPEG_QUALITY, quality]
+    )
+    if not ok:
+        raise ValueError("Failed to encode synthetic image")
+    return buffer.tobytes()
+
+
+def encode_base64_jpeg(image_rgb: np.ndarray) -> str:
+    """Encode an RGB image as a data URI, as sent to /register-face"""
+    data = base64.b64encode(encode_jpeg(image_rgb)).decode("ascii")
+    return f"data:image/jpeg;base64,{data}"
+
+
+def make_gallery(n_students: int, rng: np.random.Generator, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Random L2-normalized embeddings, one row per enrolled student"""
+    gallery = rng.standard_normal((n_students, dim)).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    return gallery
+
+
+def make_probe_embeddings(
+    gallery: np.ndarray,
+    n_faces: int,
+    rng: np.random.Generator,
+    noise: float = 0.5,
+    present_ratio: float = 0.8
+) -> np.ndarray:
+    """
+    Simulate embeddings detected in a group photo
+
+    About present_ratio of the probes are noisy copies of gallery rows
+    (students who are present), the rest are unrelated faces.
+    """
+    dim = gallery.shape[1]
+    n_present = min(int(n_faces * present_ratio), gallery.shape[0])
+    present = rng.choice(gallery.shape[0], size=n_present, replace=False)
+
+    probes = rng.standard_normal((n_faces, dim)).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    probes[:n_present] = gallery[present] + probes[:n_present] * noise
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return probes
+
+
+def gallery_payload(gallery: np.ndarray, prefix: str = "STU") -> List[dict]:
+    """Convert a gallery matrix to the stored_embeddings JSON shape"""
+    return [
+        {"student_id": f"{prefix}{i:06d}", "embedding": row.tolist()}
+        for i, row in enumerate(gallery)
+    ]
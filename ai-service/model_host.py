@@ -0,0 +1,325 @@
+"""
+Model hosting for the AI service
+Loads YOLO and InsightFace, either in-process or in one shared model-host process
+
+With `uvicorn app:app --workers N` every worker would otherwise load its own
+copy of the models. In model-host mode a single process owns the inference
+sessions and API workers send it decoded images through shared memory: the
+worker copies the image into a SharedMemory buffer once, and the host runs
+inference on a zero-copy NumPy view of that buffer. Only the small results
+(boxes and embeddings) travel back over the connection.
+
+Run the host on its own:
+    MODEL_HOST_AUTHKEY=secret python model_host.py --address 127.0.0.1:6010
+then start the API with MODEL_HOST_ADDRESS / MODEL_HOST_AUTHKEY set.
+Or use serve.py, which starts both.
+"""
+from multiprocessing import shared_memory, util
+from multiprocessing.connection import Client, Listener
+from typing import List, NamedTuple, Optional, Tuple, Union
+import argparse
+import os
+import queue
+import threading
+import numpy as np
+
+
+YOLO_CONF = 0.3
+YOLO_IOU = 0.5
+BUFFER_KEEP_BYTES = 8 * 1024 * 1024  # Per-thread buffer kept between calls (a 1920x1080 BGR image is ~6 MB)
+REPLY_TIMEOUT_SECONDS = 120.0  # How long a worker waits for the model host to answer one call
+SHM_DIR = "/dev/shm"  # tmpfs behind POSIX shared memory on Linux
+
+
+class HostedFace(NamedTuple):
+    """InsightFace result returned by the model host (same attributes the app uses)"""
+    bbox: np.ndarray  # [x1, y1, x2, y2]
+    embedding: np.ndarray
+
+
+def load_yolo():
+    """Load one YOLO face detector instance"""
+    from ultralytics import YOLO
+
+    # ---------------- YOLOv8 Face Detector ----------------
+    return YOLO(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "yolov9t-face-lindevs.pt")
+    )  # lightweight & fast
+
+
+def load_models():
+    """
+    Load the YOLO face detector and InsightFace buffalo_l models
+
+    Returns:
+        (yolo_face, arcface_app)
+    """
+    from insightface.app import FaceAnalysis
+
+    yolo_face = load_yolo()
+
+    arcface_app = FaceAnalysis(
+        name="buffalo_l",          # stable, bundled model
+        providers=["CPUExecutionProvider"]
+    )
+    arcface_app.prepare(ctx_id=0, det_size=(640, 640))
+
+    return yolo_face, arcface_app
+
+
+def yolo_boxes(yolo_face, image: np.ndarray) -> List[List[int]]:
+    """Run YOLO face detection and return boxes as [x1, y1, x2, y2]"""
+    results = yolo_face(image, conf=YOLO_CONF, iou=YOLO_IOU)[0]
+    return [list(map(int, box.xyxy[0])) for box in results.boxes]
+
+
+def parse_address(address: str) -> Union[Tuple[str, int], str]:
+    """'host:port' becomes a TCP address, anything else is a Unix socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+_attach_lock = threading.Lock()
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to a worker's buffer without registering it with the resource tracker"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # Python < 3.13 registers attached segments too. When the host shares a
+    # resource tracker with the workers (serve.py), that registration would
+    # collide with the worker's own, so skip it while attaching.
+    from multiprocessing import resource_tracker
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class ModelHost:
+    """Serves detection and embedding requests from API workers"""
+
+    def __init__(self, arcface_concurrency: Optional[int] = None, yolo_concurrency: Optional[int] = None):
+        yolo_face, self.arcface_app = load_models()
+        # Ultralytics models are not thread safe, so each concurrent detection
+        # gets its own instance (yolov9t is about 4 MB) from this pool
+        self.yolo_pool = queue.Queue()
+        self.yolo_pool.put(yolo_face)
+        for _ in range((yolo_concurrency or os.cpu_count() or 1) - 1):
+            self.yolo_pool.put(load_yolo())
+        # ONNX Runtime sessions are thread safe, so InsightFace requests from
+        # different workers share one session, up to arcface_concurrency at once
+        self.arcface_slots = threading.BoundedSemaphore(arcface_concurrency or os.cpu_count() or 1)
+
+    def run(self, op: str, image: np.ndarray):
+        if op == "detect":
+            yolo_face = self.yolo_pool.get()
+            try:
+                return yolo_boxes(yolo_face, image)
+            finally:
+                self.yolo_pool.put(yolo_face)
+        if op == "analyze":
+            with self.arcface_slots:
+                faces = self.arcface_app.get(image)
+            # Plain tuples so results unpickle even when this file runs as __main__
+            return [(np.array(f.bbox), np.array(f.embedding)) for f in faces]
+        raise ValueError(f"Unknown model host operation: {op}")
+
+    def handle(self, conn):
+        """Answer requests on one worker connection until it closes"""
+        with conn:
+            while True:
+                try:
+                    op, shm_name, shape, dtype = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    shm = attach_shared_memory(shm_name)
+                except Exception as e:
+                    conn.send(("error", str(e)))
+                    continue
+
+                image = None
+                try:
+                    # Zero-copy view of the worker's decoded image
+                    image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                    reply = ("ok", self.run(op, image))
+                except Exception as e:
+                    reply = ("error", str(e))
+                # The view must be gone before the buffer can be closed
+                del image
+                shm.close()
+                conn.send(reply)
+
+    def serve(self, address: str, authkey: bytes, ready=None):
+        """Accept worker connections forever, one thread per connection"""
+        with Listener(parse_address(address), authkey=authkey) as listener:
+            print(f"Model host listening on {address}")
+            if ready is not None:
+                ready.set()
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Bad authkey or a client that hung up during the handshake
+                    print(f"Warning: Model host rejected a connection: {str(e)}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+def run_model_host(
+    address: str,
+    authkey: bytes,
+    ready=None,
+    arcface_concurrency: Optional[int] = None,
+    yolo_concurrency: Optional[int] = None
+):
+    """Process entry point: load the models once and serve them"""
+    try:
+        ModelHost(arcface_concurrency, yolo_concurrency).serve(address, authkey, ready)
+    except KeyboardInterrupt:
+        # Ctrl-C reaches the whole process group; the launcher handles shutdown
+        pass
+
+
+class ModelHostClient:
+    """
+    Worker-side proxy for the model host
+
+    Each thread keeps its own connection and a reusable shared-memory buffer
+    of up to BUFFER_KEEP_BYTES. Larger images get a one-off buffer that is
+    unlinked as soon as the call returns, so /dev/shm use stays bounded.
+    """
+
+    def __init__(self, address: str, authkey: bytes, timeout: float = REPLY_TIMEOUT_SECONDS):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.local = threading.local()
+        self.buffers: List[shared_memory.SharedMemory] = []
+        self.buffers_lock = threading.Lock()
+        # Unlike atexit, this also runs in multiprocessing children such as uvicorn workers.
+        # Buffers of a worker that is killed are reclaimed by the resource tracker.
+        util.Finalize(None, self.close, exitpriority=0)
+
+    def _connection(self):
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = Client(self.address, authkey=self.authkey)
+        return self.local.conn
+
+    def _buffer(self, nbytes: int) -> shared_memory.SharedMemory:
+        kept = getattr(self.local, "shm", None)
+        if kept is not None and kept.size >= nbytes:
+            return kept
+
+        # tmpfs pages are allocated on first write, and a write past the limit
+        # kills the process with SIGBUS, so refuse up front instead
+        if os.path.isdir(SHM_DIR):
+            stats = os.statvfs(SHM_DIR)
+            if stats.f_bavail * stats.f_frsize < nbytes:
+                raise RuntimeError(
+                    f"Not enough shared memory in {SHM_DIR} for a {nbytes / (1024 * 1024):.1f} MB image"
+                )
+
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        with self.buffers_lock:
+            self.buffers.append(shm)
+        if nbytes <= BUFFER_KEEP_BYTES:
+            if kept is not None:
+                self._release(kept)
+            self.local.shm = shm
+        return shm
+
+    def _release(self, shm: shared_memory.SharedMemory):
+        """Close and unlink a buffer, unless it was already released"""
+        with self.buffers_lock:
+            if shm not in self.buffers:
+                return
+            self.buffers.remove(shm)
+        shm.close()
+        shm.unlink()
+
+    def _drop_connection(self):
+        """Close this thread's connection so the next call reconnects"""
+        conn, self.local.conn = getattr(self.local, "conn", None), None
+        if conn is not None:
+            conn.close()
+
+    def _call(self, op: str, image: np.ndarray):
+        image = np.ascontiguousarray(image)
+        shm = self._buffer(image.nbytes)
+        try:
+            np.copyto(np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf), image)
+            request = (op, shm.name, image.shape, image.dtype.str)
+
+            try:
+                conn = self._connection()
+                conn.send(request)
+                if not conn.poll(self.timeout):
+                    # A late reply would answer the next request, and the host may
+                    # still be reading the buffer, so drop both
+                    self._drop_connection()
+                    if shm is getattr(self.local, "shm", None):
+                        self.local.shm = None
+                    raise RuntimeError(f"Model host did not answer within {self.timeout:.0f} s")
+                status, result = conn.recv()
+            except (EOFError, OSError) as e:
+                self._drop_connection()
+                raise RuntimeError(f"Model host unavailable: {str(e)}")
+        finally:
+            # One-off buffers (large images, or dropped after a timeout) are not kept
+            if shm is not getattr(self.local, "shm", None):
+                self._release(shm)
+
+        if status != "ok":
+            raise RuntimeError(f"Model host error: {result}")
+        return result
+
+    def detect(self, image: np.ndarray) -> List[List[int]]:
+        """YOLO face boxes as [x1, y1, x2, y2]"""
+        return self._call("detect", image)
+
+    def analyze(self, image_bgr: np.ndarray) -> List[HostedFace]:
+        """InsightFace detection and embedding on a BGR image"""
+        return [HostedFace(bbox, embedding) for bbox, embedding in self._call("analyze", image_bgr)]
+
+    def close(self):
+        """Unlink every shared-memory buffer this worker created"""
+        with self.buffers_lock:
+            buffers, self.buffers = self.buffers, []
+        for shm in buffers:
+            try:
+                shm.close()
+                shm.unlink()
+            except (BufferError, FileNotFoundError):
+                continue
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host the face models for API worker processes")
+    parser.add_argument("--address", default=os.environ.get("MODEL_HOST_ADDRESS", "127.0.0.1:6010"),
+                        help="host:port or Unix socket path")
+    parser.add_argument("--arcface-concurrency", type=int, default=None,
+                        help="Concurrent InsightFace inferences (default: CPU count)")
+    parser.add_argument("--yolo-concurrency", type=int, default=None,
+                        help="YOLO instances, i.e. concurrent detections (default: CPU count)")
+    args = parser.parse_args()
+
+    authkey = os.environ.get("MODEL_HOST_AUTHKEY")
+    if not authkey:
+        raise SystemExit("MODEL_HOST_AUTHKEY must be set")
+    run_model_host(
+        args.address,
+        authkey.encode(),
+        arcface_concurrency=args.arcface_concurrency,
+        yolo_concurrency=args.yolo_concurrency
+    )
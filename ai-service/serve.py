@@ -0,0 +1,70 @@
+"""
+Run the AI service on all cores with a single copy of the models
+
+Starts one model-host process (see model_host.py) and then uvicorn with
+N API workers that send it images over shared memory.
+
+Usage:
+    python serve.py --workers 4 --port 8000
+"""
+import argparse
+import multiprocessing
+import os
+import secrets
+import uvicorn
+
+from model_host import run_model_host
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the AI service with a shared model host")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--model-host-address", default="127.0.0.1:6010",
+                        help="host:port or Unix socket path for the model host")
+    parser.add_argument("--arcface-concurrency", type=int, default=None,
+                        help="Concurrent InsightFace inferences in the model host (default: CPU count)")
+    parser.add_argument("--yolo-concurrency", type=int, default=None,
+                        help="YOLO instances in the model host, i.e. concurrent detections (default: CPU count)")
+    parser.add_argument("--model-load-timeout", type=float, default=300.0,
+                        help="Seconds to wait for the model host to load the models")
+    args = parser.parse_args()
+
+    # Workers inherit these and connect to the model host instead of loading models
+    authkey = os.environ.get("MODEL_HOST_AUTHKEY") or secrets.token_hex(16)
+    os.environ["MODEL_HOST_ADDRESS"] = args.model_host_address
+    os.environ["MODEL_HOST_AUTHKEY"] = authkey
+    # Lets the app refuse endpoints that keep state in a single worker
+    os.environ["AI_SERVICE_WORKERS"] = str(args.workers)
+    if args.workers > 1:
+        print("Warning: Cached galleries and attendance sessions are per worker and "
+              f"are disabled with {args.workers} workers; use --workers 1 to enable them")
+
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    host = ctx.Process(
+        target=run_model_host,
+        args=(
+            args.model_host_address,
+            authkey.encode(),
+            ready,
+            args.arcface_concurrency,
+            args.yolo_concurrency
+        ),
+        name="model-host",
+        daemon=True
+    )
+    host.start()
+
+    try:
+        if not ready.wait(args.model_load_timeout) or not host.is_alive():
+            raise SystemExit("Model host failed to start")
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        host.terminate()
+        host.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -163,6 +163,29 @@ class FaceEmbedding {
     }));
   }
 
+  /**
+   * Get the latest embedding of every enrolled student, across all classes
+   */
+  static async findAll() {
+    const query = `
+      SELECT DISTINCT ON (student_id) student_id, embedding
+      FROM face_embeddings
+      ORDER BY student_id, created_at DESC
+    `;
+    const result = await pool.query(query);
+
+    const embeddings = [];
+    for (const row of result.rows) {
+      try {
+        embeddings.push({ student_id: row.student_id, embedding: parseEmbedding(row.embedding) });
+      } catch (error) {
+        // Skip unreadable embeddings, as findByStudentId does
+        console.error(`Error parsing embedding for student ${row.student_id}:`, error.message);
+      }
+    }
+    return embeddings;
+  }
+
   /**
    * Update embedding for a student
    */
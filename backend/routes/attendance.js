@@ -54,37 +54,24 @@ router.post('/mark', authenticate, upload.single('photo'), async (req, res) => {
       return res.status(500).json({ error: 'AI service not configured' });
     }
 
-    // Extract face embeddings from group photo using AI service
-    let faceData;
+    // Detect, embed and match faces in one call to the AI service
+    let matchResult;
     try {
-      faceData = await AIService.extractFaceEmbeddings(req.file.buffer);
+      matchResult = await AIService.recognizeAttendance(
+        req.file.buffer,
+        storedEmbeddings
+      );
     } catch (error) {
-      console.error('Error extracting face embeddings:', error);
+      console.error('Error recognizing faces:', error);
       return res.status(500).json({ 
-        error: `Failed to extract face embeddings: ${error.message}` 
+        error: `Failed to recognize faces: ${error.message}` 
       });
     }
 
-    console.log(faceData)
-
-    if (!faceData || faceData.total_faces === 0) {
+    if (!matchResult || matchResult.total_faces_detected === 0) {
       return res.status(400).json({ error: 'No faces detected in the photo' });
     }
 
-    // Match faces with stored embeddings
-    let matchResult;
-    try {
-      matchResult = await AIService.matchFaces(
-        storedEmbeddings,
-        faceData.faces
-      );
-    } catch (error) {
-      console.error('Error matching faces:', error);
-      return res.status(500).json({ 
-        error: `Failed to match faces: ${error.message}` 
-      });
-    }
-
     // Save attendance records
     const attendanceDate = new Date(date).toISOString().split('T')[0];
     const attendanceRecords = [];
@@ -125,7 +112,7 @@ router.post('/mark', authenticate, upload.single('photo'), async (req, res) => {
         total_students: students.length,
         present: matchedStudentIds.size,
         absent: students.length - matchedStudentIds.size,
-        faces_detected: faceData.total_faces || matchResult.total_faces_detected || 0,
+        faces_detected: matchResult.total_faces_detected || 0,
         faces_matched: matchResult.matched_faces
       },
       attendance: attendanceRecords
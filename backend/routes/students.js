@@ -44,12 +44,28 @@ router.post('/register', authenticate, upload.array('photos', 5), async (req, re
       return `data:${file.mimetype};base64,${base64}`;
     });
 
-    // Register face with AI service
-    const faceData = await AIService.registerFace(student.id.toString(), images);
+    // Register face with AI service, checking it against every enrolled student
+    const enrolledEmbeddings = await FaceEmbedding.findAll();
+    const faceData = await AIService.registerFace(student.id.toString(), images, enrolledEmbeddings);
 
     // Store embedding in database
     await FaceEmbedding.create(student.id, faceData.embedding);
 
+    // Students whose enrolled face is nearly identical, e.g. the same child under another roll number
+    const possibleDuplicates = [];
+    for (const match of faceData.possible_duplicates || []) {
+      const duplicate = await Student.findById(match.student_id);
+      if (duplicate) {
+        possibleDuplicates.push({
+          id: duplicate.id,
+          name: duplicate.name,
+          roll_number: duplicate.roll_number,
+          class_id: duplicate.class_id,
+          similarity: match.similarity
+        });
+      }
+    }
+
     res.status(201).json({
       message: 'Student registered successfully',
       student: {
@@ -57,7 +73,8 @@ router.post('/register', authenticate, upload.array('photos', 5), async (req, re
         name: student.name,
         roll_number: student.roll_number,
         class_id: student.class_id
-      }
+      },
+      possible_duplicates: possibleDuplicates
     });
   } catch (error) {
     console.error('Student registration error:', error);
@@ -8,14 +8,19 @@ const AI_SERVICE_URL = process.env.AI_SERVICE_URL || 'http://localhost:8000';
 class AIService {
   /**
    * Register face by sending images to AI service
+   * With storedEmbeddings, the AI service also reports enrolled students with a near-identical face
    */
-  static async registerFace(student_id, images) {
+  static async registerFace(student_id, images, storedEmbeddings = []) {
     try {
       const response = await axios.post(
         `${AI_SERVICE_URL}/register-face`,
         {
           student_id,
-          images
+          images,
+          stored_embeddings: storedEmbeddings.map(emb => ({
+            student_id: emb.student_id.toString(),
+            embedding: emb.embedding
+          }))
         },
         {
           headers: {
@@ -106,6 +111,61 @@ class AIService {
     }
   }
 
+  /**
+   * Detect, embed and match faces in a group photo in a single call
+   */
+  static async recognizeAttendance(imageBuffer, storedEmbeddings) {
+    try {
+      const FormData = require('form-data');
+      const form = new FormData();
+      form.append('file', Buffer.from(imageBuffer), {
+        filename: 'group-photo.jpg',
+        contentType: 'image/jpeg'
+      });
+      // Sent as a file part: the AI service caps plain text fields at 1 MB (about 90 students)
+      form.append('stored_embeddings', Buffer.from(JSON.stringify(
+        storedEmbeddings.map(emb => ({
+          student_id: emb.student_id.toString(),
+          embedding: emb.embedding
+        }))
+      )), {
+        filename: 'stored-embeddings.json',
+        contentType: 'application/json'
+      });
+
+      const response = await axios.post(
+        `${AI_SERVICE_URL}/recognize-attendance`,
+        form,
+        {
+          headers: {
+            ...form.getHeaders(),
+            'Content-Length' : form.getLengthSync()
+          },
+          timeout: 120000 // 2 minutes timeout for detection and matching
+        }
+      );
+      return response.data;
+    } catch (error) {
+      const errorDetail = error.response?.data?.detail || error.response?.data?.message || error.message;
+      const errorData = error.response?.data;
+      console.error('AI Service recognizeAttendance error:', {
+        status: error.response?.status,
+        statusText: error.response?.statusText,
+        detail: errorDetail,
+        data: errorData,
+        responseType: error.response?.headers?.['content-type'],
+        code: error.code
+      });
+
+      // Handle connection errors
+      if (error.code === 'ECONNREFUSED' || error.code === 'ETIMEDOUT') {
+        throw new Error(`Cannot connect to AI service at ${AI_SERVICE_URL}. Please ensure the AI service is running.`);
+      }
+
+      throw new Error(`AI Service error: ${errorDetail}`);
+    }
+  }
+
   /**
    * Match face embeddings with stored embeddings
    */